@@ -0,0 +1,5 @@
+-- Near-duplicate cluster assigned by the MinHash/LSH stage of generate_features.py.
+-- NULL means the song has no near-duplicates and is its own cluster.
+ALTER TABLE music_features ADD COLUMN cluster_id INT;
+
+CREATE INDEX IF NOT EXISTS idx_music_features_cluster_id ON music_features (cluster_id);
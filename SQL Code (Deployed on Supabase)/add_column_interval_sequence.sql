@@ -0,0 +1,3 @@
+-- Interval sequence of each song's first track, one character per interval ('0'-'9', 'a', 'b').
+-- The query-by-melody index is rebuilt from these over the whole table after every run.
+ALTER TABLE music_features ADD COLUMN interval_sequence TEXT;
@@ -0,0 +1,3 @@
+-- MinHash signature of each song's interval sequence, written by generate_features.py.
+-- Near-duplicate clusters are rebuilt from these over the whole table after every run.
+ALTER TABLE music_features ADD COLUMN minhash_signature BIGINT[];
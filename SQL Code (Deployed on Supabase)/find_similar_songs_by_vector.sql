@@ -1,7 +1,10 @@
+DROP FUNCTION IF EXISTS find_similar_songs_by_vector(vector, INT);
+
 -- Create or Replace the function
 CREATE OR REPLACE FUNCTION find_similar_songs_by_vector(
     input_vector vector(128),
-    top_n INT DEFAULT 10
+    top_n INT DEFAULT 10,
+    collapse_duplicates BOOLEAN DEFAULT TRUE
 ) RETURNS TABLE (
     id INT,
     title TEXT,
@@ -10,15 +13,35 @@ CREATE OR REPLACE FUNCTION find_similar_songs_by_vector(
 ) AS $$
 BEGIN
     RETURN QUERY
+    WITH candidates AS (
+        -- Over-fetch so that collapsing near-duplicates still leaves top_n songs
+        SELECT
+            mf.id,
+            mf.title,
+            mf.creators,
+            COALESCE(mf.cluster_id, mf.id) AS cluster,
+            mf.feature_vector <=> input_vector AS distance
+        FROM
+            music_features mf
+        ORDER BY
+            mf.feature_vector <=> input_vector
+        LIMIT CASE WHEN collapse_duplicates THEN top_n * 4 ELSE top_n END
+    ),
+    representatives AS (
+        SELECT DISTINCT ON (CASE WHEN collapse_duplicates THEN c.cluster ELSE c.id END)
+            c.id, c.title, c.creators, c.distance
+        FROM candidates c
+        ORDER BY CASE WHEN collapse_duplicates THEN c.cluster ELSE c.id END, c.distance
+    )
     SELECT
-        mf.id,
-        mf.title,
-        mf.creators,
-        1 - (mf.feature_vector <=> input_vector) AS similarity
+        r.id,
+        r.title,
+        r.creators,
+        1 - r.distance AS similarity
     FROM
-        music_features mf
+        representatives r
     ORDER BY
-        mf.feature_vector <=> input_vector
+        r.distance
     LIMIT top_n;
 END;
-$$ LANGUAGE plpgsql STABLE;
\ No newline at end of file
+$$ LANGUAGE plpgsql STABLE;
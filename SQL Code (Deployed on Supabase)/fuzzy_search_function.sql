@@ -1,24 +1,50 @@
+DROP FUNCTION IF EXISTS search_songs_by_title(TEXT, INT);
+
 CREATE OR REPLACE FUNCTION search_songs_by_title(
   search_query TEXT,
-  max_results INT DEFAULT 10
+  max_results INT DEFAULT 10,
+  collapse_duplicates BOOLEAN DEFAULT TRUE
 ) RETURNS TABLE (
   id INT,
   title TEXT,
   creators TEXT[],
   similarity NUMERIC
 ) LANGUAGE sql STABLE AS $$
+  WITH candidates AS (
+    -- Over-fetch so that collapsing near-duplicates still leaves max_results songs
+    SELECT
+      id,
+      title,
+      creators,
+      COALESCE(cluster_id, id) AS cluster,
+      similarity(title, search_query) AS similarity
+    FROM
+      music_features
+    WHERE
+      title ILIKE '%' || search_query || '%'
+      OR similarity(title, search_query) > 0.2
+    ORDER BY
+      similarity DESC,
+      title,
+      id
+    LIMIT CASE WHEN collapse_duplicates THEN max_results * 4 ELSE max_results END
+  ),
+  representatives AS (
+    SELECT DISTINCT ON (CASE WHEN collapse_duplicates THEN cluster ELSE id END)
+      id, title, creators, similarity
+    FROM candidates
+    ORDER BY CASE WHEN collapse_duplicates THEN cluster ELSE id END, similarity DESC, title, id
+  )
   SELECT
     id,
     title,
     creators,
-    similarity(title, search_query) AS similarity
+    similarity
   FROM
-    music_features
-  WHERE
-    title ILIKE '%' || search_query || '%'
-    OR similarity(title, search_query) > 0.2
+    representatives
   ORDER BY
     similarity DESC,
-    title
+    title,
+    id
   LIMIT max_results;
-$$;
\ No newline at end of file
+$$;
@@ -1,33 +1,102 @@
-from flask import Flask, request, jsonify
+import os
+import sys
+import json
+import threading
+from flask import Flask, Response, request, jsonify
 import numpy as np
-import pandas as pd
 from sentence_transformers import SentenceTransformer
 from annoy import AnnoyIndex
 
+# The helper scripts import their siblings by module name, as when run as scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'helper_scripts'))
+from melody_index import MelodyIndex, NGRAM_SIZE
+from knn_graph import KnnGraph
+from metadata_table import MetadataTable, build_metadata_table, source_stamp, save_source_stamp, is_stale
+
 app = Flask(__name__)
 
+# Limits for bulk POST /search requests, so offline jobs cannot starve interactive users
+MAX_BATCH_QUERIES = 1000        # Queries accepted per request
+MAX_BATCH_RESULTS = 50          # Upper bound on max_results per query
+BATCH_CHUNK_SIZE = 64           # Queries encoded together before streaming their results
+MAX_CONCURRENT_BATCHES = 2      # Bulk requests served at once; further ones get 429
+batch_slots = threading.BoundedSemaphore(MAX_CONCURRENT_BATCHES)
+
+MAX_MELODY_RESULTS = 50         # Upper bound on max_results of /search/melody (re-ranked from a 100-song shortlist)
+
 # Load data and model once when the app starts
 print("Loading data and model...")
-songs_df = pd.read_csv('data/songs_with_ids.csv')
-song_titles = songs_df['title'].tolist()
-embeddings = np.load('data/song_embeddings.npy').astype('float32')
+# Song metadata and the Annoy index are built to disk and memory-mapped read-only,
+# so every worker shares the same pages instead of holding its own copy. Each records
+# the size and mtime of its source file and is rebuilt when the source changes.
+if is_stale('data/metadata_table/source_stamp.npy', 'data/songs_with_ids.csv'):
+    build_metadata_table('data/songs_with_ids.csv', 'data/metadata_table')
+songs = MetadataTable('data/metadata_table')
+print(f"Metadata for {len(songs)} songs loaded successfully.")
 
 # Build the Annoy index
+embeddings = np.load('data/song_embeddings.npy', mmap_mode='r')
 embedding_dim = embeddings.shape[1]
-index = AnnoyIndex(embedding_dim, 'angular')  # 'angular' is suitable for cosine similarity
-for i, vector in enumerate(embeddings):
-    index.add_item(i, vector)
-index.build(10)  # Number of trees can be adjusted
-print("Annoy index built successfully.")
+if not os.path.exists('data/song_embeddings.ann') or is_stale('data/song_embeddings.ann.stamp.npy', 'data/song_embeddings.npy'):
+    stamp = source_stamp('data/song_embeddings.npy')
+    builder = AnnoyIndex(embedding_dim, 'angular')  # 'angular' is suitable for cosine similarity
+    for i, vector in enumerate(embeddings):
+        builder.add_item(i, vector.astype('float32'))
+    builder.build(10)  # Number of trees can be adjusted
+    builder.save(f'data/song_embeddings.ann.{os.getpid()}')
+    builder.unload()
+    # Replace the index before its stamp, so a stamp never vouches for an older index
+    os.replace(f'data/song_embeddings.ann.{os.getpid()}', 'data/song_embeddings.ann')
+    save_source_stamp(f'data/song_embeddings.ann.stamp.{os.getpid()}.npy', stamp)
+    os.replace(f'data/song_embeddings.ann.stamp.{os.getpid()}.npy', 'data/song_embeddings.ann.stamp.npy')
+index = AnnoyIndex(embedding_dim, 'angular')
+index.load('data/song_embeddings.ann')  # Memory-mapped, shared between workers
+print("Annoy index loaded successfully.")
+
+# Annoy item i is row i of the metadata table, so all three must describe the same songs
+if not len(songs) == index.get_n_items() == len(embeddings):
+    raise RuntimeError(
+        f"Song data out of sync: {len(songs)} metadata rows, {index.get_n_items()} Annoy items, "
+        f"{len(embeddings)} embeddings. Re-run preprocessing/create_embeddings.R."
+    )
 
 # Load the SentenceTransformer model
 model = SentenceTransformer('all-MiniLM-L6-v2')
 print("Model loaded successfully.")
 
+# Load the query-by-melody index written by helper_scripts/generate_features.py
+melody_index = MelodyIndex('data/melody_index') if os.path.isdir('data/melody_index') else None
+if melody_index is not None:
+    print("Melody index loaded successfully.")
+
+# Load the precomputed neighbour graph written by helper_scripts/build_knn_graph.py
+knn_graph = KnnGraph('data/knn_graph') if os.path.isdir('data/knn_graph') else None
+if knn_graph is not None:
+    print("Neighbour graph loaded successfully.")
+
+def parse_max_results(value, limit):
+    """max_results from a request clamped to [1, limit], or None if it is not an integer."""
+    try:
+        return max(1, min(int(value), limit))
+    except (TypeError, ValueError):
+        return None
+
+def search_titles(query_embedding, max_results, details=False):
+    """
+    Nearest songs to a query embedding.
+
+    Returns titles, or metadata records (title, creators, key signature) when details is set.
+    """
+    indices = index.get_nns_by_vector(query_embedding, max_results)
+    if details:
+        return [songs.record(i) for i in indices]
+    return [songs.title(i) for i in indices]
+
 @app.route('/search', methods=['GET'])
 def search():
     query = request.args.get('query', '')
     max_results = int(request.args.get('max_results', 10))
+    details = request.args.get('details', 'false').lower() == 'true'
     if len(query) < 2:
         return jsonify([])
 
@@ -35,8 +104,101 @@ def search():
     query_embedding = model.encode([query], show_progress_bar=False)[0].astype('float32')
 
     # Perform similarity search
-    indices = index.get_nns_by_vector(query_embedding, max_results)
-    results = [song_titles[i] for i in indices]
+    results = search_titles(query_embedding, max_results, details)
+
+    return jsonify(results)
+
+@app.route('/search', methods=['POST'])
+def search_batch():
+    # Body: {"queries": [...], "max_results": 10}; one NDJSON line per query is streamed back
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    queries = payload.get('queries')
+    max_results = parse_max_results(payload.get('max_results', 10), MAX_BATCH_RESULTS)
+    details = str(payload.get('details', 'false')).lower() == 'true'
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify({'error': 'queries must be a list of strings'}), 400
+    if max_results is None:
+        return jsonify({'error': 'max_results must be an integer'}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per request'}), 413
+    if not batch_slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many bulk searches in progress, retry later'}), 429
+
+    def generate():
+        for start in range(0, len(queries), BATCH_CHUNK_SIZE):
+            chunk = queries[start:start + BATCH_CHUNK_SIZE]
+            # Encode the whole chunk in one model call; queries under 2 characters get no results
+            searchable = [offset for offset, query in enumerate(chunk) if len(query) >= 2]
+            query_embeddings = {}
+            if searchable:
+                encoded = model.encode([chunk[offset] for offset in searchable], batch_size=BATCH_CHUNK_SIZE,
+                                       show_progress_bar=False).astype('float32')
+                query_embeddings = dict(zip(searchable, encoded))
+
+            for offset, query in enumerate(chunk):
+                results = []
+                if offset in query_embeddings:
+                    results = search_titles(query_embeddings[offset], max_results, details)
+                yield json.dumps({'index': start + offset, 'query': query, 'results': results}) + '\n'
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    # Released when the stream finishes or the client disconnects
+    response.call_on_close(batch_slots.release)
+    return response
+
+@app.route('/search/melody', methods=['GET'])
+def search_melody():
+    # Notes as comma-separated MIDI pitches or note names, e.g. "60,62,64,65,67" or "C,D,E,F,G"
+    notes = [note.strip() for note in request.args.get('notes', '').split(',') if note.strip()]
+    max_results = parse_max_results(request.args.get('max_results', 10), MAX_MELODY_RESULTS)
+    collapse_duplicates = request.args.get('collapse_duplicates', 'true').lower() != 'false'
+    if max_results is None:
+        return jsonify({'error': 'max_results must be an integer'}), 400
+    if melody_index is None:
+        return jsonify({'error': 'Melody index is not available'}), 503
+    if len(notes) < NGRAM_SIZE + 1:
+        return jsonify([])
+
+    try:
+        results = melody_index.search(notes, max_results, collapse_duplicates=collapse_duplicates)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(results)
+
+@app.route('/similar', methods=['GET', 'POST'])
+def similar():
+    # GET ?id=... answers from the neighbour graph; POST {"vector": [...]} runs a live search
+    payload = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    if request.method == 'POST' and not isinstance(payload, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    collapse_duplicates = str(payload.get('collapse_duplicates', 'true')).lower() != 'false'
+    if knn_graph is None:
+        return jsonify({'error': 'Neighbour graph is not available'}), 503
+    # Capped at the neighbours stored per song, so an id lookup is always one graph row
+    max_results = parse_max_results(payload.get('max_results', 10), knn_graph.k)
+    if max_results is None:
+        return jsonify({'error': 'max_results must be an integer'}), 400
+
+    # Edited feature vectors are not in the graph, so they fall back to a live search
+    if payload.get('vector') is not None:
+        try:
+            results = knn_graph.similar_to_vector(payload['vector'], max_results, collapse_duplicates)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(results)
+
+    if payload.get('id') is None:
+        return jsonify({'error': 'Either id or vector is required'}), 400
+    try:
+        song_id = int(payload['id'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'id must be an integer'}), 400
+    results = knn_graph.similar_to_id(song_id, max_results, collapse_duplicates)
+    if results is None:
+        return jsonify({'error': 'Song not found in neighbour graph'}), 404
 
     return jsonify(results)
 
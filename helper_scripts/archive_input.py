@@ -0,0 +1,166 @@
+import bz2
+import os
+import struct
+import tarfile
+import zipfile
+import zlib
+from functools import partial
+
+try:
+    import zstandard
+except ImportError:  # Only needed for .tar.zst archives
+    zstandard = None
+
+MEMBERS_PER_SHARD = 500             # Songs handed to a pool worker at once
+JSONL_SHARD_BYTES = 64 * 1024 * 1024
+
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.zst', '.tar.zstd', '.zip', '.jsonl')
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _ranges(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _zip_shards(path, members_per_shard):
+    # Record where each member's local header sits so workers can read members
+    # without parsing the central directory again
+    with zipfile.ZipFile(path) as archive:
+        members = [(info.filename, info.header_offset, info.compress_type, info.compress_size,
+                    info.file_size, info.CRC, info.flag_bits)
+                   for info in archive.infolist() if info.filename.endswith('.json')]
+    for members_range in _ranges(members, members_per_shard):
+        yield {'path': path, 'format': 'zip', 'members': members_range}
+
+
+def _tar_shards(path, members_per_shard):
+    # Uncompressed tar: record where each member's data starts so workers can seek to it
+    with tarfile.open(path, 'r:') as archive:
+        members = [(m.name, m.offset_data, m.size) for m in archive if m.isfile() and m.name.endswith('.json')]
+    for members_range in _ranges(members, members_per_shard):
+        yield {'path': path, 'format': 'tar', 'members': members_range}
+
+
+def _jsonl_shards(path, shard_bytes):
+    # Split into byte ranges that end on line boundaries
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        start = 0
+        while start < size:
+            file.seek(min(start + shard_bytes, size))
+            file.readline()
+            end = min(file.tell(), size)
+            yield {'path': path, 'format': 'jsonl', 'start': start, 'end': end}
+            start = end
+
+
+def _open_compressed_tar(file, path):
+    if path.lower().endswith(('.tar.zst', '.tar.zstd')):
+        if zstandard is None:
+            raise ImportError("Reading .tar.zst archives requires the 'zstandard' package.")
+        return tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(file), mode='r|')
+    return tarfile.open(fileobj=file, mode='r|gz')
+
+
+def _compressed_tar_shards(path, members_per_shard):
+    # Compressed streams cannot be seeked, so members are read here in one pass and
+    # their raw bytes are shipped to the workers, which do the JSON parsing
+    with open(path, 'rb') as file, _open_compressed_tar(file, path) as archive:
+        batch = []
+        for member in archive:
+            if not member.isfile() or not member.name.endswith('.json'):
+                continue
+            batch.append((member.name, archive.extractfile(member).read()))
+            if len(batch) == members_per_shard:
+                yield {'path': path, 'format': 'payload', 'members': batch}
+                batch = []
+        if batch:
+            yield {'path': path, 'format': 'payload', 'members': batch}
+
+
+def iter_shards(path, members_per_shard=MEMBERS_PER_SHARD):
+    """
+    Split an archive of PDMX songs into shards of work for pool workers.
+
+    Zip, plain tar and JSONL shards only describe a range of members, and each
+    worker reads its own range. Members of gzip or zstd compressed tars are
+    decompressed in one pass here and shipped with the shard.
+    """
+    lower = path.lower()
+    if lower.endswith('.zip'):
+        return _zip_shards(path, members_per_shard)
+    if lower.endswith('.tar'):
+        return _tar_shards(path, members_per_shard)
+    if lower.endswith('.jsonl'):
+        return _jsonl_shards(path, JSONL_SHARD_BYTES)
+    return _compressed_tar_shards(path, members_per_shard)
+
+
+def _read_zip_member(file, header_offset, compress_type, compress_size, size, crc, flag_bits):
+    file.seek(header_offset)
+    header = file.read(30)
+    if len(header) < 30 or header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile("bad local file header")
+    if flag_bits & 0x1:
+        raise NotImplementedError("encrypted members are not supported")
+    # The data follows the fixed header, the member name and the extra field
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    file.seek(name_length + extra_length, os.SEEK_CUR)
+    data = file.read(compress_size)
+    if len(data) < compress_size:
+        raise EOFError(f"member truncated: expected {compress_size} bytes, got {len(data)}")
+    if compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -15)
+    elif compress_type == zipfile.ZIP_BZIP2:
+        data = bz2.decompress(data)
+    elif compress_type != zipfile.ZIP_STORED:
+        raise NotImplementedError(f"zip compression method {compress_type} is not supported")
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise zipfile.BadZipFile("Bad CRC-32")
+    return data
+
+
+def _read_tar_member(file, offset, size):
+    file.seek(offset)
+    data = file.read(size)
+    if len(data) < size:
+        raise EOFError(f"member truncated: expected {size} bytes, got {len(data)}")
+    return data
+
+
+def _payload(data):
+    return data
+
+
+def iter_shard_members(shard):
+    """
+    Yield (source name, read) for every member of a shard.
+
+    read() returns the member's raw JSON bytes. Reading is left to the caller so
+    that a corrupt member (bad CRC, truncated tar data) raises there and can be
+    skipped without abandoning the rest of the shard.
+    """
+    path, shard_format = shard['path'], shard['format']
+    if shard_format == 'zip':
+        with open(path, 'rb') as file:
+            for name, *member in shard['members']:
+                yield f"{path}:{name}", partial(_read_zip_member, file, *member)
+    elif shard_format == 'tar':
+        with open(path, 'rb') as file:
+            for name, offset, size in shard['members']:
+                yield f"{path}:{name}", partial(_read_tar_member, file, offset, size)
+    elif shard_format == 'jsonl':
+        with open(path, 'rb') as file:
+            file.seek(shard['start'])
+            while file.tell() < shard['end']:
+                offset = file.tell()
+                line = file.readline()
+                if line.strip():
+                    yield f"{path}@{offset}", partial(_payload, line)
+    else:
+        for name, payload in shard['members']:
+            yield f"{path}:{name}", partial(_payload, payload)
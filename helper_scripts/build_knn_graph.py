@@ -0,0 +1,72 @@
+import json
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from supabase import create_client, Client
+from dotenv import load_dotenv
+from knn_graph import build_knn_graph, normalize_rows
+from string_arena import pack_strings
+
+load_dotenv()
+
+# Supabase configuration
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Output location of the neighbour graph read by app.py
+KNN_GRAPH_DIR = "data/knn_graph"
+VECTOR_SIZE = 128
+PAGE_SIZE = 1000
+
+def export_feature_matrix(graph_dir, page_size=PAGE_SIZE):
+    """
+    Page through music_features and write the normalised (n, 128) feature matrix.
+
+    Rows are written straight into a memory-mapped features.npy, ordered by id, next to
+    the ids, cluster ids and titles of the songs.
+    """
+    os.makedirs(graph_dir, exist_ok=True)
+    count = supabase.table("music_features").select("id", count="exact").limit(1).execute().count
+
+    features = open_memmap(os.path.join(graph_dir, "features.npy"), mode="w+",
+                           dtype=np.float32, shape=(count, VECTOR_SIZE))
+    ids = np.zeros(count, dtype=np.int64)
+    cluster_ids = np.zeros(count, dtype=np.int64)
+    titles = []
+
+    row, last_id = 0, -1
+    while row < count:
+        response = (supabase.table("music_features")
+                    .select("id, title, cluster_id, feature_vector")
+                    .gt("id", last_id).order("id").limit(page_size).execute())
+        if not response.data:
+            break
+        for song in response.data[:count - row]:
+            vector = song["feature_vector"]
+            # pgvector columns come back from PostgREST as a string
+            features[row] = json.loads(vector) if isinstance(vector, str) else vector
+            ids[row] = song["id"]
+            cluster_ids[row] = song["cluster_id"] if song["cluster_id"] is not None else song["id"]
+            titles.append(song["title"])
+            row += 1
+        last_id = response.data[-1]["id"]
+        print(f"Exported {row}/{count} feature vectors.")
+
+    normalize_rows(features)
+    features.flush()
+    if row < count:
+        # Songs were deleted while paging; drop the unused tail rows
+        trimmed = np.array(features[:row])
+        del features
+        np.save(os.path.join(graph_dir, "features.npy"), trimmed)
+
+    title_offsets, title_arena = pack_strings(titles)
+    np.save(os.path.join(graph_dir, "ids.npy"), ids[:row])
+    np.save(os.path.join(graph_dir, "cluster_ids.npy"), cluster_ids[:row])
+    np.save(os.path.join(graph_dir, "title_offsets.npy"), title_offsets)
+    np.save(os.path.join(graph_dir, "titles.npy"), title_arena)
+
+if __name__ == "__main__":
+    export_feature_matrix(KNN_GRAPH_DIR)
+    build_knn_graph(KNN_GRAPH_DIR)
@@ -0,0 +1,91 @@
+import zlib
+import numpy as np
+
+# MinHash / LSH configuration
+NUM_PERM = 128          # Number of hash permutations per signature
+LSH_BANDS = 16          # NUM_PERM must be divisible by LSH_BANDS (8 rows per band)
+SHINGLE_SIZE = 5        # Consecutive intervals per shingle
+JACCARD_THRESHOLD = 0.7 # Estimated similarity needed to merge two songs
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Fixed seed so signatures stay comparable across ingestion runs and workers
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, np.iinfo(np.int64).max, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_PERM_B = _rng.randint(0, np.iinfo(np.int64).max, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+
+
+def interval_shingles(intervals, k=SHINGLE_SIZE):
+    """Hash every run of k consecutive intervals to a 32-bit shingle id."""
+    data = bytes(intervals)
+    if len(data) < k:
+        return np.array([zlib.crc32(data)], dtype=np.uint64)
+    shingles = {zlib.crc32(data[i:i + k]) for i in range(len(data) - k + 1)}
+    return np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signature(intervals):
+    """Compute the MinHash signature of a song's interval sequence."""
+    shingles = interval_shingles(intervals)
+    # Universal hashing (a * x + b) mod p, one row per permutation
+    hashed = (np.outer(_PERM_A, shingles) + _PERM_B[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def estimated_jaccard(sig_a, sig_b):
+    """Fraction of agreeing MinHash slots, an estimate of shingle Jaccard similarity."""
+    return float(np.count_nonzero(sig_a == sig_b)) / len(sig_a)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def assign_duplicate_clusters(song_ids, signatures, bands=LSH_BANDS, threshold=JACCARD_THRESHOLD):
+    """
+    Group near-duplicate songs using LSH banding over MinHash signatures.
+
+    Songs sharing any band bucket become candidates; a candidate is merged with the
+    first song of the bucket when their estimated Jaccard similarity clears the
+    threshold. Only candidate pairs are compared, never all pairs.
+
+    Args:
+        song_ids (list): Identifiers of the songs, parallel to signatures.
+        signatures (list): MinHash signatures from minhash_signature.
+        bands (int): Number of LSH bands.
+        threshold (float): Minimum estimated Jaccard similarity to merge.
+
+    Returns:
+        dict: Mapping of song id to cluster id (the smallest song id in its cluster).
+    """
+    n = len(song_ids)
+    if n == 0:
+        return {}
+    signatures = np.asarray(signatures, dtype=np.uint32)
+    rows = signatures.shape[1] // bands
+    parent = list(range(n))
+
+    for band in range(bands):
+        buckets = {}
+        band_slice = signatures[:, band * rows:(band + 1) * rows]
+        for i in range(n):
+            key = band_slice[i].tobytes()
+            first = buckets.setdefault(key, i)
+            if first == i:
+                continue
+            root_first, root_i = _find(parent, first), _find(parent, i)
+            if root_first != root_i and estimated_jaccard(signatures[first], signatures[i]) >= threshold:
+                parent[root_i] = root_first
+
+    # Use the smallest song id of each cluster as its representative
+    representative = {}
+    for i in range(n):
+        root = _find(parent, i)
+        if root not in representative or song_ids[i] < representative[root]:
+            representative[root] = song_ids[i]
+    return {song_ids[i]: representative[_find(parent, i)] for i in range(n)}
+
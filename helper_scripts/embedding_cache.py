@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+import struct
+import tempfile
+import unicodedata
+import numpy as np
+
+_MAGIC = b"FD2PEMB1"
+_HEADER = struct.Struct("<8sI4x")   # magic, embedding dimension, padding to 16 bytes
+
+
+def normalize_title(title):
+    """Normalise a title so trivially different copies share one cache entry."""
+    title = unicodedata.normalize("NFKC", title)
+    return re.sub(r"\s+", " ", title).strip().lower()
+
+
+class TitleEmbeddingCache:
+    """
+    Disk-backed, content-addressed cache of title embeddings.
+
+    Entries are keyed by sha1(model id + normalised title) and stored as fixed-size
+    (key, float32 vector) records in one append-only file per model, which is
+    memory-mapped on open. Each record is appended with a single O_APPEND write,
+    so pool workers can share the file and an interrupted run only loses the
+    record being written.
+    """
+
+    def __init__(self, cache_dir, model_id):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.model_id = model_id
+        self.path = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9._-]", "_", model_id) + ".bin")
+        self.dim = None
+        self.hits = 0
+        self.misses = 0
+        self._records = None
+        self._index = {}
+        self._new = {}
+        self._load()
+
+    def _record_dtype(self):
+        return np.dtype([("key", "V20"), ("vector", "<f4", (self.dim,))])
+
+    def _load(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < _HEADER.size:
+            return
+        with open(self.path, "rb") as file:
+            magic, self.dim = _HEADER.unpack(file.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError(f"{self.path} is not a title embedding cache.")
+
+        record_size = self._record_dtype().itemsize
+        count, torn = divmod(os.path.getsize(self.path) - _HEADER.size, record_size)
+        if torn:
+            # Drop a record cut short by a crash so later appends stay aligned
+            os.truncate(self.path, _HEADER.size + count * record_size)
+        if count:
+            self._records = np.memmap(self.path, dtype=self._record_dtype(), mode="r",
+                                      offset=_HEADER.size, shape=(count,))
+            self._index = {key: i for i, key in enumerate(self._records["key"].tolist())}
+
+    def _key(self, title):
+        return hashlib.sha1(f"{self.model_id}\0{normalize_title(title)}".encode("utf-8")).digest()
+
+    def lookup(self, title):
+        """Return the cached embedding of a title, or None if it has not been embedded yet."""
+        key = self._key(title)
+        if key in self._new:
+            vector = self._new[key]
+        elif key in self._index:
+            vector = np.array(self._records["vector"][self._index[key]])
+        else:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return vector
+
+    def store(self, title, vector):
+        """Append an embedding to the cache file."""
+        vector = np.asarray(vector, dtype="<f4").reshape(-1)
+        if self.dim is None:
+            self.dim = len(vector)
+            # Write the header to a temp file and link it into place, so the cache file
+            # never exists without its header for another worker to append to
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            try:
+                os.write(fd, _HEADER.pack(_MAGIC, self.dim))
+                os.close(fd)
+                os.link(tmp_path, self.path)
+            except FileExistsError:
+                pass  # Another worker created the file first
+            finally:
+                os.unlink(tmp_path)
+        elif len(vector) != self.dim:
+            raise ValueError(f"Expected a {self.dim}-d embedding for {self.model_id}, got {len(vector)}.")
+
+        key = self._key(title)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, key + vector.tobytes())
+        finally:
+            os.close(fd)
+        self._new[key] = vector
+
+    def embed_titles(self, titles, encode):
+        """
+        Embed a list of titles, running encode only on titles missing from the cache.
+
+        Args:
+            titles (list): Titles to embed; repeats are encoded once.
+            encode (callable): Maps a list of titles to an (n, dim) array of embeddings.
+
+        Returns:
+            np.ndarray: float32 array of shape (len(titles), dim).
+        """
+        vectors = [self.lookup(title) for title in titles]
+        missing = {}
+        for title, vector in zip(titles, vectors):
+            if vector is None:
+                missing.setdefault(self._key(title), title)
+        # Repeats within the batch are served by the first copy's encoding
+        repeats = sum(vector is None for vector in vectors) - len(missing)
+        self.misses -= repeats
+        self.hits += repeats
+
+        if missing:
+            encoded = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            for title, vector in zip(missing.values(), encoded):
+                self.store(title, vector)
+            vectors = [vector if vector is not None else self._new[self._key(title)]
+                       for title, vector in zip(titles, vectors)]
+        return np.ascontiguousarray(np.vstack(vectors)) if vectors else np.empty((0, self.dim or 0), np.float32)
+
+    def report(self, hits=None, misses=None):
+        """Print the hit ratio, for this cache or for counts aggregated across workers."""
+        hits = self.hits if hits is None else hits
+        misses = self.misses if misses is None else misses
+        total = hits + misses
+        ratio = hits / total if total else 0
+        print(f"Title embedding cache ({self.model_id}): {hits} hits, {misses} misses, {ratio:.1%} hit ratio.")
@@ -1,13 +1,19 @@
 import json
 import numpy as np
 import os
+import sys
 import multiprocessing
-from collections import Counter
+from collections import Counter, deque
+from functools import partial
 from supabase import create_client, Client
 from transformers import AutoTokenizer, AutoModel
 import torch
 import os
 from dotenv import load_dotenv
+from dedup import minhash_signature, assign_duplicate_clusters
+from melody_index import build_melody_index, encode_interval_sequence, decode_interval_sequence
+from embedding_cache import TitleEmbeddingCache
+from archive_input import is_archive, iter_shards, iter_shard_members
 
 load_dotenv()
 
@@ -17,8 +23,12 @@ SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # Load the gte-small model
-tokenizer = AutoTokenizer.from_pretrained("thenlper/gte-small")
-model = AutoModel.from_pretrained("thenlper/gte-small")
+TITLE_MODEL_ID = "thenlper/gte-small"
+tokenizer = AutoTokenizer.from_pretrained(TITLE_MODEL_ID)
+model = AutoModel.from_pretrained(TITLE_MODEL_ID)
+
+# Title embeddings are reused across copies of a title and across ingestion runs
+title_cache = TitleEmbeddingCache("data/embedding_cache", TITLE_MODEL_ID)
 
 # Fixed chord vocabulary for roots and types
 CHORD_ROOTS = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
@@ -27,6 +37,12 @@ CHORD_TYPES = ['', 'm', 'dim', 'aug', '7', 'maj7', 'min7', 'dim7']
 # Fixed time signature vocabulary
 TIME_SIGNATURES_VOCAB = ['4/4', '3/4', '6/8', '9/8', '2/4', '12/8']
 
+# Output location of the query-by-melody inverted index
+MELODY_INDEX_DIR = "data/melody_index"
+
+# Rows per request when reading the whole corpus back from Supabase
+PAGE_SIZE = 1000
+
 def normalize_histogram(histogram, bins):
     """Normalize a histogram to a fixed number of bins."""
     result = [0] * bins
@@ -125,6 +141,8 @@ def write_to_supabase(features, vector, title_embedding):
         "time_signatures": features.get("time_signatures", []),
         "feature_vector": vector.tolist(),
         "title_embedding": json.dumps(title_embedding.tolist()),
+        "minhash_signature": features['minhash_signature'],
+        "interval_sequence": features['interval_sequence'],
     }
 
     # Perform the insertion
@@ -133,14 +151,52 @@ def write_to_supabase(features, vector, title_embedding):
     # Check the response
     if response.data:
         print(f"Data for '{features['title']}' successfully inserted into Supabase.")
+        return response.data[0]['id']
     else:
         print(f"Error inserting data for '{features['title']}': {response.error}")
+        return None
 
-def extract_features_and_save(file_path):
+def extract_features_and_save(file_path, handler=None):
     try:
         with open(file_path, "r") as file:
             data = json.load(file)
-        
+    except Exception as e:
+        print(f"Error processing file {file_path}: {e}")
+        return
+
+    return (handler or extract_features_from_data)(data, file_path)
+
+def extract_features_from_shard(shard, handler=None):
+    """Process every song in an archive shard (see archive_input.iter_shards)."""
+    handler = handler or extract_features_from_data
+    records = []
+    try:
+        for source, read in iter_shard_members(shard):
+            try:
+                data = json.loads(read())
+            except Exception as e:
+                # Corrupt member (bad CRC, truncated data) or invalid JSON; skip just this song
+                print(f"Error processing file {source}: {e}")
+                continue
+            record = handler(data, source)
+            if record is not None:
+                records.append(record)
+    except Exception as e:
+        # The shard could not be opened or iterated; keep the songs read so far
+        print(f"Error reading shard of {shard['path']}: {e}")
+    return records
+
+def shard_records(result):
+    """Wait for a shard submitted to the pool; an empty list if its worker failed."""
+    try:
+        return result.get()
+    except Exception as e:
+        print(f"Error processing shard: {e}")
+        return []
+
+def extract_song_features(data, file_path):
+    """Validate a PDMX song and compute its features; (features, vector), or None if it is skipped."""
+    try:
         features = {}
         features['title'] = data.get('metadata', {}).get('title')
         features['creators'] = data.get('metadata', {}).get('creators')
@@ -239,31 +295,198 @@ def extract_features_and_save(file_path):
             f"{ts.get('numerator', 'Unknown')}/{ts.get('denominator', 'Unknown')}" for ts in time_signatures
         ]
 
-        # Generate the title embedding
-        title_embedding = generate_title_embedding(features['title'])
-
         # Encode song features
         vector = encode_song_features(features)
+        features['minhash_signature'] = minhash_signature(raw_intervals).tolist()
+        features['interval_sequence'] = encode_interval_sequence(raw_intervals)
+        return features, vector
+    except Exception as e:
+        print(f"Error processing file {file_path}: {e}")
+
+def extract_features_from_data(data, file_path):
+    extracted = extract_song_features(data, file_path)
+    if extracted is None:
+        return
+    features, vector = extracted
+    try:
+        # Generate the title embedding, unless this title has been embedded before
+        title_embedding = title_cache.lookup(features['title'])
+        title_embedding_cached = title_embedding is not None
+        if not title_embedding_cached:
+            title_embedding = generate_title_embedding(features['title'])
+            title_cache.store(features['title'], title_embedding)
 
         # Write to Supabase
-        write_to_supabase(features, vector, title_embedding)
+        song_id = write_to_supabase(features, vector, title_embedding)
+        if song_id is None:
+            return
+
+        return {
+            "id": song_id,
+            "title_embedding_cached": title_embedding_cached,
+        }
     except Exception as e:
         print(f"Error processing file {file_path}: {e}")
 
-def process_files_in_directory(directory):
-    # Collect all JSON files
+def backfill_record(data, file_path):
+    """Dedup and melody columns of a song, keyed by its title and stored feature vector."""
+    extracted = extract_song_features(data, file_path)
+    if extracted is None:
+        return
+    features, vector = extracted
+    return {
+        "key": song_key(features['title'], vector),
+        "minhash_signature": features['minhash_signature'],
+        "interval_sequence": features['interval_sequence'],
+    }
+
+def song_key(title, vector):
+    # feature_vector is stored as float32, so compare at that precision
+    return title, np.asarray(vector, dtype=np.float32).tobytes()
+
+def process_songs(directory, handler):
+    """Run handler over every song in a directory of JSON files and archives; returns its records."""
+    # Collect all JSON files, and any archives of them (tar, tar.gz/zst, zip, jsonl)
     json_files = []
+    archives = []
+    if os.path.isfile(directory) and is_archive(directory):
+        archives.append(directory)
     for root, dirs, files in os.walk(directory):
         for file in files:
             if file.endswith(".json"):
                 json_files.append(os.path.join(root, file))
+            elif is_archive(file):
+                archives.append(os.path.join(root, file))
 
     # Process files using multiprocessing for speed
     pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-    pool.map(extract_features_and_save, json_files)
-    pool.close()
-    pool.join()
+    try:
+        records = pool.map(partial(extract_features_and_save, handler=handler), json_files)
+        # Archives are split into shards of members, read and parsed by the workers. Only a
+        # bounded number of shards is in flight, as compressed-tar shards carry member bytes
+        max_pending_shards = 2 * multiprocessing.cpu_count()
+        for archive in archives:
+            pending = deque()
+            try:
+                for shard in iter_shards(archive):
+                    pending.append(pool.apply_async(extract_features_from_shard, (shard, handler)))
+                    if len(pending) >= max_pending_shards:
+                        records.extend(shard_records(pending.popleft()))
+            except Exception as e:
+                # Unreadable archive or a compressed stream that breaks off; keep the shards read so far
+                print(f"Error reading archive {archive}: {e}")
+            while pending:
+                records.extend(shard_records(pending.popleft()))
+    finally:
+        pool.close()
+        pool.join()
+    return [record for record in records if record is not None]
+
+def process_files_in_directory(directory):
+    records = process_songs(directory, extract_features_from_data)
+    cache_hits = sum(record['title_embedding_cached'] for record in records)
+    title_cache.report(hits=cache_hits, misses=len(records) - cache_hits)
+    clusters = save_duplicate_clusters()
+    save_melody_index(clusters)
+
+def fetch_corpus(columns):
+    """Page through every row of music_features, ordered by id."""
+    last_id = -1
+    while True:
+        response = (supabase.table("music_features").select(f"id, {columns}")
+                    .gt("id", last_id).order("id").limit(PAGE_SIZE).execute())
+        if not response.data:
+            return
+        yield from response.data
+        last_id = response.data[-1]["id"]
+
+def save_duplicate_clusters():
+    """
+    Cluster near-duplicate songs with MinHash/LSH over the whole corpus and store the cluster ids.
+
+    Signatures are read back from music_features, so songs from earlier runs are
+    compared with new ones. Only rows whose cluster changed are updated.
+    """
+    song_ids, signatures, current = [], [], {}
+    for song in fetch_corpus("cluster_id, minhash_signature"):
+        if song["minhash_signature"]:
+            song_ids.append(song["id"])
+            signatures.append(song["minhash_signature"])
+            current[song["id"]] = song["cluster_id"]
+    clusters = assign_duplicate_clusters(song_ids, signatures)
+
+    # Singletons keep a NULL cluster_id, which the SQL functions treat as their own id
+    cluster_sizes = Counter(clusters.values())
+    changed = {}
+    for song_id, cluster_id in clusters.items():
+        target = cluster_id if cluster_sizes[cluster_id] > 1 else None
+        if current[song_id] != target:
+            changed.setdefault(target, []).append(song_id)
+
+    for cluster_id, members in changed.items():
+        for start in range(0, len(members), PAGE_SIZE):
+            response = (supabase.table("music_features").update({"cluster_id": cluster_id})
+                        .in_("id", members[start:start + PAGE_SIZE]).execute())
+            if not response.data:
+                print(f"Error assigning cluster {cluster_id}: {response.error}")
+
+    clustered = sum(size for size in cluster_sizes.values() if size > 1)
+    print(f"{clustered} of {len(song_ids)} songs are in "
+          f"{sum(size > 1 for size in cluster_sizes.values())} near-duplicate clusters "
+          f"({sum(len(m) for m in changed.values())} updated).")
+    return clusters
+
+def backfill_missing_columns(directory):
+    """
+    Fill minhash_signature and interval_sequence for rows ingested before those columns existed.
+
+    The raw intervals are not stored in music_features, so the songs are re-read from
+    their source files. A row is matched to its song by title and feature vector, which is
+    deterministic in the song's features; write_to_supabase only inserts, so re-running
+    the normal ingestion would duplicate the rows instead.
+    """
+    missing = {}
+    for song in fetch_corpus("title, feature_vector, minhash_signature, interval_sequence"):
+        if song["minhash_signature"] and song["interval_sequence"]:
+            continue
+        vector = song["feature_vector"]
+        # pgvector columns come back from PostgREST as a string
+        vector = json.loads(vector) if isinstance(vector, str) else vector
+        missing.setdefault(song_key(song["title"], vector), []).append(song["id"])
+    print(f"{sum(len(ids) for ids in missing.values())} songs lack dedup or melody columns.")
+
+    filled = 0
+    if missing:
+        for record in process_songs(directory, backfill_record):
+            ids = missing.get(record["key"])
+            if not ids:
+                continue
+            # Identical copies match the same key; each source file fills one row
+            response = (supabase.table("music_features")
+                        .update({"minhash_signature": record["minhash_signature"],
+                                 "interval_sequence": record["interval_sequence"]})
+                        .eq("id", ids.pop()).execute())
+            if response.data:
+                filled += 1
+            else:
+                print(f"Error backfilling '{record['key'][0]}': {response.error}")
+    print(f"Backfilled {filled} songs; {sum(len(ids) for ids in missing.values())} have no source file.")
+
+    clusters = save_duplicate_clusters()
+    save_melody_index(clusters)
+
+def save_melody_index(clusters):
+    """Rebuild the query-by-melody index from the interval sequences of the whole corpus."""
+    songs = [
+        {"id": song["id"], "title": song["title"], "intervals": decode_interval_sequence(song["interval_sequence"])}
+        for song in fetch_corpus("title, interval_sequence") if song["interval_sequence"]
+    ]
+    build_melody_index(songs, MELODY_INDEX_DIR, clusters)
 
 if __name__ == "__main__":
     data_directory = "/Users/antanaszilinskas/Desktop/Imperial College London/D2P/Coursework/PDMX/data/" # Path to the data directory
-    process_files_in_directory(data_directory)
\ No newline at end of file
+    # --backfill fills the dedup and melody columns of songs already in music_features
+    if "--backfill" in sys.argv:
+        backfill_missing_columns(data_directory)
+    else:
+        process_files_in_directory(data_directory)
\ No newline at end of file
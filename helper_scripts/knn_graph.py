@@ -0,0 +1,228 @@
+import os
+import multiprocessing
+import numpy as np
+from numpy.lib.format import open_memmap
+from string_arena import arena_string
+
+# Neighbour graph configuration
+NUM_NEIGHBOURS = 50     # Neighbours kept per song
+BLOCK_SIZE = 4096       # Rows per query block and per column tile (bounds worker memory)
+
+_GRAPH_FILES = ['ids', 'features', 'cluster_ids', 'title_offsets', 'titles', 'neighbours', 'scores',
+                'cluster_neighbours', 'cluster_scores']
+
+
+def normalize_rows(matrix, block_size=BLOCK_SIZE):
+    """L2-normalise rows in place, block by block, so dot products are cosine similarities."""
+    for start in range(0, len(matrix), block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        matrix[start:start + block_size] = block / norms
+
+
+def _top_k(scores, indices, k):
+    """Keep the k best (score, index) pairs per row, sorted by descending score."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    scores = np.take_along_axis(scores, part, axis=1)
+    indices = np.take_along_axis(indices, part, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def _best_per_cluster(scores, indices, clusters):
+    """Keep the best-scoring entry of each cluster in every row; the others become -inf."""
+    order = np.lexsort((-scores, clusters), axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    clusters = np.take_along_axis(clusters, order, axis=1)
+    scores[:, 1:][clusters[:, 1:] == clusters[:, :-1]] = -np.inf
+    return scores, np.take_along_axis(indices, order, axis=1)
+
+
+def _merge_clusters(cluster_ids, kept_scores, kept_indices, scores, indices, k):
+    """Merge tile candidates into the kept per-cluster neighbours of a set of rows."""
+    scores = np.hstack([kept_scores, scores])
+    indices = np.hstack([kept_indices, indices])
+    clusters = cluster_ids[np.maximum(indices, 0)]
+    return _top_k(*_best_per_cluster(scores, indices, clusters), k)
+
+
+def _knn_block(args):
+    """
+    Compute the neighbours of one block of rows against every column tile.
+
+    Two lists are kept per row: the k nearest songs, and the nearest song of each
+    of the k nearest other near-duplicate clusters (the row's own cluster excluded).
+    """
+    graph_dir, start, k, block_size = args
+    features = np.load(os.path.join(graph_dir, 'features.npy'), mmap_mode='r')
+    cluster_ids = np.load(os.path.join(graph_dir, 'cluster_ids.npy'), mmap_mode='r')
+    n = len(features)
+    stop = min(start + block_size, n)
+    queries = np.asarray(features[start:stop])
+    query_clusters = np.asarray(cluster_ids[start:stop])
+    rows = np.arange(start, stop)
+
+    best_scores = np.full((stop - start, k), -np.inf, dtype=np.float32)
+    best_indices = np.full((stop - start, k), -1, dtype=np.int64)
+    cluster_scores = np.full((stop - start, k), -np.inf, dtype=np.float32)
+    cluster_indices = np.full((stop - start, k), -1, dtype=np.int64)
+    for tile_start in range(0, n, block_size):
+        tile = np.asarray(features[tile_start:tile_start + block_size])
+        tile_clusters = np.asarray(cluster_ids[tile_start:tile_start + len(tile)])
+        scores = queries @ tile.T
+        columns = np.arange(tile_start, tile_start + len(tile))
+        if tile_start < stop and tile_start + len(tile) > start:
+            # A song is not its own neighbour; only the tile overlapping the block holds self-matches
+            scores[rows[:, None] == columns[None, :]] = -np.inf
+        best_scores, best_indices = _top_k(
+            np.hstack([best_scores, scores]),
+            np.hstack([best_indices, np.broadcast_to(columns, scores.shape)]),
+            k,
+        )
+
+        # Collapsed list: never the row's own cluster, one entry per other cluster. Only
+        # the tile's top 2k columns are merged; a column outside them cannot make the
+        # top k clusters if those columns already span k clusters, else the row takes
+        # the whole tile
+        scores[query_clusters[:, None] == tile_clusters[None, :]] = -np.inf
+        m = min(2 * k, len(tile))
+        part = np.argpartition(-scores, m - 1, axis=1)[:, :m]
+        part_scores = np.take_along_axis(scores, part, axis=1)
+        spanned = np.isfinite(_best_per_cluster(part_scores, part, tile_clusters[part])[0]).sum(axis=1)
+        whole_tile = (spanned < k) & (m < len(tile))
+        narrow = ~whole_tile
+        cluster_scores[narrow], cluster_indices[narrow] = _merge_clusters(
+            cluster_ids, cluster_scores[narrow], cluster_indices[narrow],
+            part_scores[narrow], tile_start + part[narrow], k)
+        if whole_tile.any():
+            cluster_scores[whole_tile], cluster_indices[whole_tile] = _merge_clusters(
+                cluster_ids, cluster_scores[whole_tile], cluster_indices[whole_tile],
+                scores[whole_tile], np.broadcast_to(columns, scores.shape)[whole_tile], k)
+    # Rows with fewer than k other clusters end in -1 entries
+    cluster_indices[np.isneginf(cluster_scores)] = -1
+
+    for name, values in (('neighbours', best_indices), ('scores', best_scores),
+                         ('cluster_neighbours', cluster_indices), ('cluster_scores', cluster_scores)):
+        output = np.load(os.path.join(graph_dir, f"{name}.npy"), mmap_mode='r+')
+        output[start:stop] = values
+        output.flush()
+    return stop - start
+
+
+def build_knn_graph(graph_dir, k=NUM_NEIGHBOURS, block_size=BLOCK_SIZE, processes=None):
+    """
+    Compute the top-k cosine neighbours of every song in features.npy.
+
+    Query blocks are spread over a process pool; each worker multiplies its block
+    against one column tile at a time, so memory stays bounded by block_size
+    whatever the corpus size. Results go to memory-mapped (n, k) arrays:
+    neighbours.npy (row numbers) and scores.npy (cosine similarities), plus
+    cluster_neighbours.npy and cluster_scores.npy with near-duplicates collapsed,
+    so that every lookup is a single row read.
+
+    Args:
+        graph_dir (str): Directory holding features.npy, written by export_feature_matrix.
+        k (int): Number of neighbours per song.
+        block_size (int): Rows per query block and column tile.
+        processes (int): Worker processes (defaults to the CPU count).
+    """
+    features = np.load(os.path.join(graph_dir, 'features.npy'), mmap_mode='r')
+    n = len(features)
+    # With fewer than two songs there are no neighbours; write an empty (n, 0) graph
+    k = max(min(k, n - 1), 0)
+    for prefix in ('', 'cluster_'):
+        open_memmap(os.path.join(graph_dir, f'{prefix}neighbours.npy'), mode='w+', dtype=np.int32, shape=(n, k)).flush()
+        open_memmap(os.path.join(graph_dir, f'{prefix}scores.npy'), mode='w+', dtype=np.float32, shape=(n, k)).flush()
+
+    if k == 0:
+        print(f"Only {n} song(s) in {graph_dir}; the neighbour graph is empty.")
+        return
+
+    tasks = [(graph_dir, start, k, block_size) for start in range(0, n, block_size)]
+    pool = multiprocessing.Pool(processes=processes or multiprocessing.cpu_count())
+    done = 0
+    for rows in pool.imap_unordered(_knn_block, tasks):
+        done += rows
+        print(f"Neighbours computed for {done}/{n} songs.")
+    pool.close()
+    pool.join()
+
+
+class KnnGraph:
+    """Memory-mapped neighbour graph for "songs similar to this song" lookups."""
+
+    def __init__(self, graph_dir):
+        for name in _GRAPH_FILES:
+            setattr(self, name, np.load(os.path.join(graph_dir, f"{name}.npy"), mmap_mode='r'))
+        self.k = self.neighbours.shape[1]
+
+    def _row(self, song_id):
+        row = int(np.searchsorted(self.ids, song_id))
+        if row < len(self.ids) and self.ids[row] == song_id:
+            return row
+        return None
+
+    def title(self, row):
+        return arena_string(self.title_offsets, self.titles, row)
+
+    def _results(self, rows, scores, max_results, collapse_duplicates=True):
+        results, seen = [], set()
+        for row, score in zip(rows, scores):
+            if row < 0:
+                break
+            cluster = int(self.cluster_ids[row])
+            if cluster in seen:
+                continue
+            if collapse_duplicates:
+                seen.add(cluster)
+            results.append({'id': int(self.ids[row]), 'title': self.title(row), 'similarity': float(score)})
+            if len(results) == max_results:
+                break
+        return results
+
+    def _scan(self, query, k, block_size=BLOCK_SIZE):
+        """Blocked scan of every feature vector; returns the rows and scores of the k best."""
+        k = min(k, len(self.ids))
+        best_scores = np.full((1, 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((1, 0), dtype=np.int64)
+        for start in range(0, len(self.features), block_size):
+            scores = (np.asarray(self.features[start:start + block_size]) @ query)[None, :]
+            rows = np.arange(start, start + scores.shape[1])[None, :]
+            best_scores, best_rows = _top_k(np.hstack([best_scores, scores]), np.hstack([best_rows, rows]), k)
+        return best_rows[0], best_scores[0]
+
+    def similar_to_id(self, song_id, max_results=10, collapse_duplicates=True):
+        """
+        Read the precomputed neighbours of a song; None if it is not in the graph.
+
+        At most k (the graph's neighbours per song) results are returned. With
+        collapse_duplicates the song's own cluster is left out and every other
+        cluster appears once, as collapsed when the graph was built.
+        """
+        row = self._row(song_id)
+        if row is None:
+            return None
+        if collapse_duplicates:
+            neighbours, scores = self.cluster_neighbours[row], self.cluster_scores[row]
+        else:
+            neighbours, scores = self.neighbours[row], self.scores[row]
+        return self._results(neighbours[:max_results], scores[:max_results], max_results, collapse_duplicates=False)
+
+    def similar_to_vector(self, vector, max_results=10, collapse_duplicates=True, block_size=BLOCK_SIZE):
+        """Live blocked scan for vectors that are not in the graph, e.g. edited feature vectors."""
+        try:
+            query = np.asarray(vector, dtype=np.float32)
+        except (TypeError, ValueError):
+            raise ValueError("vector must be a list of numbers")
+        if query.shape != self.features.shape[1:]:
+            raise ValueError(f"vector must have {self.features.shape[1]} values")
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        # Over-fetch so that collapsing near-duplicates still fills max_results
+        k = max_results * 4 if collapse_duplicates else max_results
+        rows, scores = self._scan(query, k, block_size)
+        return self._results(rows, scores, max_results, collapse_duplicates=collapse_duplicates)
@@ -0,0 +1,267 @@
+import os
+import re
+import numpy as np
+from string_arena import pack_strings, arena_bytes, arena_string
+
+# Inverted index configuration
+NGRAM_SIZE = 4          # Intervals per n-gram (a query needs at least NGRAM_SIZE + 1 notes)
+MAX_DOC_FREQ = 0.2      # Skip n-grams present in more than this fraction of songs (e.g. repeated notes)
+
+# Local alignment scoring used to re-rank the shortlist
+MATCH_SCORE = 2
+MISMATCH_SCORE = -1
+GAP_PENALTY = 1
+
+NOTE_OFFSETS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+NOTE_PATTERN = re.compile(r'^([A-Ga-g])([#b]?)(-?\d+)?$')
+
+_INDEX_FILES = [
+    'gram_keys', 'gram_offsets', 'gram_doc_freq', 'postings',
+    'song_ids', 'cluster_ids', 'interval_offsets', 'intervals',
+    'title_offsets', 'titles',
+]
+
+
+def parse_notes(notes):
+    """Convert MIDI pitches or note names ('C4', 'F#', 'Bb3') to pitch classes."""
+    pitch_classes = []
+    for note in notes:
+        if isinstance(note, (int, np.integer)) or str(note).lstrip('-').isdigit():
+            pitch_classes.append(int(note) % 12)
+            continue
+        match = NOTE_PATTERN.match(str(note).strip())
+        if not match:
+            raise ValueError(f"Unrecognised note '{note}'.")
+        letter, accidental, _ = match.groups()
+        offset = NOTE_OFFSETS[letter.upper()] + {'#': 1, 'b': -1, '': 0}[accidental]
+        pitch_classes.append(offset % 12)
+    return pitch_classes
+
+
+def pitch_intervals(pitch_classes):
+    """Transposition-invariant interval sequence, as in extract_features_and_save."""
+    return [(j - i) % 12 for i, j in zip(pitch_classes[:-1], pitch_classes[1:])]
+
+
+_INTERVAL_DIGITS = b'0123456789ab'
+_TO_DIGITS = bytes.maketrans(bytes(range(12)), _INTERVAL_DIGITS)
+_FROM_DIGITS = bytes.maketrans(_INTERVAL_DIGITS, bytes(range(12)))
+
+
+def encode_interval_sequence(intervals):
+    """Store an interval sequence as text, one base-12 digit per interval."""
+    return bytes(intervals).translate(_TO_DIGITS).decode('ascii')
+
+
+def decode_interval_sequence(text):
+    """Inverse of encode_interval_sequence."""
+    return text.encode('ascii').translate(_FROM_DIGITS)
+
+
+def interval_ngrams(intervals, n=NGRAM_SIZE):
+    """Encode every run of n intervals as a single base-12 integer key."""
+    intervals = np.frombuffer(bytes(intervals), dtype=np.uint8).astype(np.uint32)
+    count = len(intervals) - n + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint32)
+    keys = np.zeros(count, dtype=np.uint32)
+    for i in range(n):
+        keys = keys * 12 + intervals[i:i + count]
+    return keys
+
+
+def varint_sizes(values):
+    """Number of bytes each value takes as a varint."""
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        sizes += values >= np.uint64(1 << shift)
+    return sizes
+
+
+def encode_varints(values):
+    """Vectorised LEB128 varint encoding of non-negative integers."""
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = varint_sizes(values)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    encoded = np.zeros(int(sizes.sum()), dtype=np.uint8)
+    for k in range(int(sizes.max(initial=0))):
+        mask = sizes > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        continuation = np.where(sizes[mask] - 1 > k, 0x80, 0).astype(np.uint64)
+        encoded[starts[mask] + k] = byte | continuation
+    return encoded
+
+
+def decode_varints(encoded):
+    """Vectorised inverse of encode_varints."""
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    if len(encoded) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = encoded < 0x80
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    lengths = np.diff(np.concatenate((starts, [len(encoded)])))
+    position = np.arange(len(encoded)) - np.repeat(starts, lengths)
+    contributions = (encoded & 0x7F).astype(np.int64) << (7 * position)
+    return np.add.reduceat(contributions, starts)
+
+
+def local_alignment_score(query, target):
+    """
+    Smith-Waterman local alignment score between two interval sequences.
+
+    Each query row is computed with numpy over the whole target; horizontal gaps
+    are resolved with a running maximum instead of a per-cell loop.
+    """
+    target = np.frombuffer(bytes(target), dtype=np.uint8)
+    n = len(target)
+    if n == 0:
+        return 0
+    gap_ramp = np.arange(n) * GAP_PENALTY
+    previous = np.zeros(n + 1, dtype=np.int64)
+    best = 0
+    for interval in query:
+        substitution = np.where(target == interval, MATCH_SCORE, MISMATCH_SCORE)
+        scores = np.maximum(0, np.maximum(previous[:-1] + substitution, previous[1:] - GAP_PENALTY))
+        scores = np.maximum.accumulate(scores + gap_ramp) - gap_ramp
+        best = max(best, int(scores.max()))
+        previous[1:] = scores
+    return best
+
+
+def build_melody_index(records, output_dir, clusters=None):
+    """
+    Build the interval n-gram inverted index and save it as .npy files.
+
+    Posting lists hold delta-encoded document numbers packed as varints.
+
+    Args:
+        records (list): Dicts with 'id', 'title' and 'intervals' (bytes) per song.
+        output_dir (str): Directory to write the index to.
+        clusters (dict): Optional mapping of song id to near-duplicate cluster id.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    clusters = clusters or {}
+
+    gram_parts, doc_parts = [], []
+    for doc, record in enumerate(records):
+        grams = np.unique(interval_ngrams(record['intervals']))
+        gram_parts.append(grams)
+        doc_parts.append(np.full(len(grams), doc, dtype=np.uint64))
+    grams = np.concatenate(gram_parts) if gram_parts else np.empty(0, dtype=np.uint32)
+    docs = np.concatenate(doc_parts) if doc_parts else np.empty(0, dtype=np.uint64)
+
+    # Group postings by n-gram; a stable sort keeps documents ascending within a group
+    order = np.argsort(grams, kind='stable')
+    grams, docs = grams[order], docs[order]
+    gram_keys, group_starts, doc_freq = np.unique(grams, return_index=True, return_counts=True)
+
+    deltas = docs.copy()
+    deltas[1:] -= docs[:-1]
+    deltas[group_starts] = docs[group_starts]
+    postings = encode_varints(deltas)
+
+    # Byte offsets of each posting list: sum of its varint sizes
+    gram_offsets = np.zeros(len(gram_keys) + 1, dtype=np.uint64)
+    if len(deltas):
+        gram_offsets[1:] = np.cumsum(np.add.reduceat(varint_sizes(deltas), group_starts))
+
+    interval_offsets, intervals = pack_strings([bytes(r['intervals']) for r in records])
+    title_offsets, titles = pack_strings([r['title'] for r in records])
+    song_ids = np.array([r['id'] for r in records], dtype=np.int64)
+    cluster_ids = np.array([clusters.get(r['id'], r['id']) for r in records], dtype=np.int64)
+
+    arrays = {
+        'gram_keys': gram_keys.astype(np.uint32),
+        'gram_offsets': gram_offsets,
+        'gram_doc_freq': doc_freq.astype(np.uint32),
+        'postings': postings,
+        'song_ids': song_ids,
+        'cluster_ids': cluster_ids,
+        'interval_offsets': interval_offsets,
+        'intervals': intervals,
+        'title_offsets': title_offsets,
+        'titles': titles,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), array)
+    print(f"Melody index with {len(gram_keys)} n-grams over {len(records)} songs saved to {output_dir}.")
+
+
+class MelodyIndex:
+    """Memory-mapped interval n-gram index answering query-by-melody searches."""
+
+    def __init__(self, index_dir):
+        for name in _INDEX_FILES:
+            setattr(self, name, np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r'))
+        self.num_songs = len(self.song_ids)
+
+    def _title(self, doc):
+        return arena_string(self.title_offsets, self.titles, doc)
+
+    def _intervals(self, doc):
+        return arena_bytes(self.interval_offsets, self.intervals, doc)
+
+    def _postings(self, slot):
+        start, end = int(self.gram_offsets[slot]), int(self.gram_offsets[slot + 1])
+        return np.cumsum(decode_varints(self.postings[start:end]))
+
+    def search(self, notes, max_results=10, shortlist_size=100, collapse_duplicates=True):
+        """
+        Rank songs containing the given melody.
+
+        Candidates are scored by IDF-weighted n-gram overlap, then the shortlist is
+        re-ranked by local alignment against each song's full interval sequence.
+
+        Args:
+            notes (list): MIDI pitches or note names of the melody.
+            max_results (int): Number of songs to return.
+            shortlist_size (int): Number of overlap candidates to align.
+            collapse_duplicates (bool): Return one song per near-duplicate cluster.
+
+        Returns:
+            list: Dicts with 'id', 'title' and 'score' (1.0 is an exact match).
+        """
+        query = pitch_intervals(parse_notes(notes))
+        query_grams = np.unique(interval_ngrams(query))
+        if len(query_grams) == 0 or self.num_songs == 0:
+            return []
+
+        slots = np.searchsorted(self.gram_keys, query_grams)
+        present = slots < len(self.gram_keys)
+        slots, query_grams = slots[present], query_grams[present]
+        slots = slots[self.gram_keys[slots] == query_grams]
+        if len(slots) == 0:
+            return []
+
+        # Very common n-grams add little signal and have the longest posting lists
+        doc_freq = self.gram_doc_freq[slots].astype(np.float64)
+        selective = doc_freq <= MAX_DOC_FREQ * self.num_songs
+        if selective.any():
+            slots, doc_freq = slots[selective], doc_freq[selective]
+
+        docs = [self._postings(slot) for slot in slots]
+        weights = [np.full(len(d), np.log(self.num_songs / df)) for d, df in zip(docs, doc_freq)]
+        candidates, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        overlap = np.bincount(inverse, weights=np.concatenate(weights))
+
+        if len(candidates) > shortlist_size:
+            top = np.argpartition(-overlap, shortlist_size)[:shortlist_size]
+            candidates = candidates[top]
+
+        best_score = MATCH_SCORE * len(query)
+        scored = sorted(
+            ((local_alignment_score(query, self._intervals(doc)) / best_score, int(doc)) for doc in candidates),
+            reverse=True,
+        )
+
+        results, seen = [], set()
+        for score, doc in scored:
+            cluster = int(self.cluster_ids[doc])
+            if collapse_duplicates and cluster in seen:
+                continue
+            seen.add(cluster)
+            results.append({'id': int(self.song_ids[doc]), 'title': self._title(doc), 'score': round(score, 4)})
+            if len(results) == max_results:
+                break
+        return results
@@ -0,0 +1,108 @@
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+from string_arena import pack_strings, arena_string
+
+# Text columns stored as UTF-8 arenas; missing CSV columns are stored as empty strings
+STRING_COLUMNS = ['title', 'creators', 'key_signature']
+
+_TABLE_FILES = ['ids'] + [f"{column}_{part}" for column in STRING_COLUMNS
+              for part in ('offsets', 'arena')]
+
+
+def source_stamp(path):
+    """Size and modification time (ns) of a source file, saved with what is built from it."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_source_stamp(stamp_path, stamp):
+    np.save(stamp_path, np.array(stamp, dtype=np.int64))
+
+
+def is_stale(stamp_path, source_path):
+    """True if nothing was built from source_path yet, or it has changed since."""
+    if not os.path.exists(stamp_path):
+        return True
+    return np.load(stamp_path).tolist() != source_stamp(source_path)
+
+
+def build_metadata_table(csv_path, output_dir):
+    """
+    Convert songs_with_ids.csv into a read-only, memory-mappable metadata table.
+
+    Each text column becomes one UTF-8 arena plus a uint64 offsets array, and ids
+    become an int64 array. The table is written to a
+    temporary directory and renamed into place, so concurrently starting workers
+    never see a half-written table. A table built from an older CSV is swapped out;
+    workers that already mapped it keep reading the old files until they restart.
+    """
+    stamp = source_stamp(csv_path)
+    ids = []
+    values = {column: [] for column in STRING_COLUMNS}
+
+    with open(csv_path, newline='', encoding='utf-8') as file:
+        for row_number, row in enumerate(csv.DictReader(file)):
+            song_id = int(row['id']) if row.get('id') else row_number + 1
+            ids.append(song_id)
+            for column in STRING_COLUMNS:
+                value = row.get(column) or ''
+                values[column].append('' if value == 'NA' else value)
+
+    parent_dir = os.path.dirname(os.path.abspath(output_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=parent_dir)
+    np.save(os.path.join(staging_dir, 'ids.npy'), np.array(ids, dtype=np.int64))
+    for column in STRING_COLUMNS:
+        offsets, arena = pack_strings(values[column])
+        np.save(os.path.join(staging_dir, f"{column}_offsets.npy"), offsets)
+        np.save(os.path.join(staging_dir, f"{column}_arena.npy"), arena)
+    save_source_stamp(os.path.join(staging_dir, 'source_stamp.npy'), stamp)
+
+    old_dir = tempfile.mkdtemp(dir=parent_dir)
+    try:
+        if os.path.isdir(output_dir):
+            os.rename(output_dir, os.path.join(old_dir, 'table'))
+        os.rename(staging_dir, output_dir)
+    except OSError:
+        # Another worker finished building the table first
+        shutil.rmtree(staging_dir)
+        return
+    finally:
+        shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"Metadata table for {len(ids)} songs written to {output_dir}.")
+
+
+class MetadataTable:
+    """Read-only song metadata, memory-mapped so all workers share one copy."""
+
+    def __init__(self, table_dir):
+        for name in _TABLE_FILES:
+            setattr(self, name, np.load(os.path.join(table_dir, f"{name}.npy"), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _text(self, column, row):
+        return arena_string(getattr(self, f"{column}_offsets"), getattr(self, f"{column}_arena"), row)
+
+    def title(self, row):
+        return self._text('title', row)
+
+    def record(self, row):
+        """
+        Text metadata of the song at a row, as returned by the API.
+
+        ids are left out: create_embeddings.R numbers songs_with_ids.csv with
+        row_number(), which is not the music_features id used by /similar and
+        /search/melody.
+        """
+        return {column: self._text(column, row) for column in STRING_COLUMNS}
+
+
+if __name__ == "__main__":
+    # Usage: python helper_scripts/metadata_table.py data/songs_with_ids.csv data/metadata_table
+    build_metadata_table(sys.argv[1], sys.argv[2])
@@ -0,0 +1,24 @@
+import numpy as np
+
+
+def pack_strings(items):
+    """
+    Pack strings into one uint8 arena plus a uint64 offsets array.
+
+    Item i occupies arena[offsets[i]:offsets[i + 1]]. Items may be str, stored as
+    UTF-8, or bytes, stored as they are.
+    """
+    items = [item.encode('utf-8') if isinstance(item, str) else bytes(item) for item in items]
+    offsets = np.zeros(len(items) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(item) for item in items])
+    return offsets, np.frombuffer(b''.join(items), dtype=np.uint8)
+
+
+def arena_bytes(offsets, arena, row):
+    """Slice of the arena holding item row; a view when the arena is memory-mapped."""
+    return arena[int(offsets[row]):int(offsets[row + 1])]
+
+
+def arena_string(offsets, arena, row):
+    """Item row of the arena decoded from UTF-8."""
+    return bytes(arena_bytes(offsets, arena, row)).decode('utf-8')